@@ -4,13 +4,16 @@
 # parsing information from
 # https://cs.android.com/android/platform/superproject/+/master:frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h
 
-from io import BytesIO, SEEK_CUR
+from io import BytesIO
 import os
 import sys
-from struct import pack, unpack
-from zipfile import ZipFile
+from struct import Struct
+from zipfile import ZipFile, ZIP_STORED
 import subprocess
 from shutil import which
+from tempfile import TemporaryDirectory
+from copy import copy
+from collections import namedtuple
 
 COMMON_HEADER_LEN = 8
 CHUNK_TYPE_STRINGPOOL = 0x1
@@ -30,78 +33,64 @@ UINT8_LENGTH = 1
 DEBUGGABLE_VALUE_TRUE = bytearray([0xFF, 0xFF, 0xFF, 0xFF])
 ATTRIBUTE_LENGTH = 20
 
-# UTIL
-def dumpN(buf, n):
-    l = buf.tell()
-    print([hex(el) for el in buf.read(n)])
-    buf.seek(l)
+# precompiled layouts of the records we read and write
+_U32 = Struct("<I")
+_U16 = Struct("<H")
+_HDR = Struct("<HHI") # type, headerSize, chunkSize
+_STRPOOL = Struct("<5I") # stringCount, styleCount, flags, stringsStart, stylesStart
+_SPAN = Struct("<3I") # name, firstChar, lastChar
+_ATTR_INFO = Struct("<3H") # attributeStart, attributeSize, attributeCount
+_ATTR = Struct("<IIIHBBI") # ns, name, rawValue, size, res0, dataType, data
+_REF2 = Struct("<II") # two consecutive string refs, e.g. ns and name
+_ATTR_EXT = Struct("<II3H") # ns, name, attributeStart, attributeSize, attributeCount
 
-def readInt(f, n):
-    return readType(f, n, "I", UINT32_LENGTH)
+Chunk = namedtuple("Chunk", "startOffset type headerSize chunkSize")
+Attr = namedtuple("Attr", "startOffset nsId nameId rawVal size dataType data")
 
-def readShort(f, n):
-    return readType(f, n, "H", UINT16_LENGTH)
+# UTIL
+def dumpN(buf, offset, n):
+    print([hex(el) for el in buf[offset:offset + n]])
 
-def readByte(f, n):
-    return readType(f, n, "B", UINT8_LENGTH)
+def dumpStrPool(strings):
+    for i, s in enumerate(strings):
+        print(i, s)
 
-def readType(f, n, fmtType, typeLen):
-    fmt = "<" + str(n) + fmtType
-    data = unpack(fmt, f.read(n * typeLen))
-    if n == 1:
-        return data[0]
-    else:
-        return data
-
-def isInt32NotNegative(v):
-    return ((1 << 31) & v) == 0
-
-def dumpStrPool(fIn, strPoolInfo):
-    pos = fIn.tell()
-    for i in range(strPoolInfo["stringCount"]):
-        print(i, readString(fIn, strPoolInfo, i))
-    fIn.seek(pos)
-
-def dumpResmap(fIn, resmapInfo):
-    pos = fIn.tell()
-    fIn.seek(resmapInfo["chunkInfo"]["startOffset"] + COMMON_HEADER_LEN)
-    for i in range(resmapInfo["len"]):
-        print(i, hex(readInt(fIn, 1)))
-    fIn.seek(pos)
-
-def readCommonHeader(fs):
-    data = fs.read(COMMON_HEADER_LEN)
-    if len(data) < COMMON_HEADER_LEN:
-        if len(data) > 0:
-            print("Skipping last " + str(len(data)) + " bytes")
-        return None
-    type, headerSize, size = unpack("<HHI", data)
-    return {
-        "type": type,
-        "headerSize": headerSize,
-        "chunkSize": size
-    }
+def dumpResmap(resmapInfo):
+    for i, resId in enumerate(resmapInfo["resIds"]):
+        print(i, hex(resId))
 
-def writeCommonHeader(f, type, headerSize, size):
-    f.write(pack("<HHI", type, headerSize, size))
-
-def readChunks(inStream):
-    chunk = []
-    currPos = inStream.tell()
-    while header := readCommonHeader(inStream):
-        chunk.append({
-            "startOffset": currPos,
-            "commonHeader": header
-        })
-        inStream.seek(header["chunkSize"] - COMMON_HEADER_LEN, SEEK_CUR)
-        currPos = inStream.tell()
-    return chunk
+def readCommonHeader(buf, offset):
+    if len(buf) - offset < COMMON_HEADER_LEN:
+        return None
+    return Chunk(offset, *_HDR.unpack_from(buf, offset))
+
+def writeCommonHeader(out, outOffset, type, headerSize, size):
+    _HDR.pack_into(out, outOffset, type, headerSize, size)
+
+# copies buf[start:end] to out at outOffset and returns the offset behind the copy
+def copyInto(out, outOffset, buf, start, end):
+    outEnd = outOffset + end - start
+    out[outOffset:outEnd] = buf[start:end]
+    return outEnd
+
+def readChunks(buf, offset):
+    chunks = []
+    end = len(buf)
+    while offset + COMMON_HEADER_LEN <= end:
+        (type, headerSize, chunkSize) = _HDR.unpack_from(buf, offset)
+        if chunkSize < COMMON_HEADER_LEN:
+            raise Exception("Invalid chunk size {} at {}!".format(chunkSize, offset))
+        chunks.append(Chunk(offset, type, headerSize, chunkSize))
+        offset += chunkSize
+    if offset < end:
+        print("Skipping last " + str(end - offset) + " bytes")
+    return chunks
 
 def findStringpoolAndResmap(chunks):
     stringPoolIdx = -1
     resmapIdx = -1
     for i, chunkInfo in enumerate(chunks):
-        chunkType = chunkInfo["commonHeader"]["type"]
+        chunkType = chunkInfo.type
         if chunkType == CHUNK_TYPE_STRINGPOOL:
             if stringPoolIdx >= 0:
                 raise Exception("More than one string pool!")
@@ -114,10 +103,9 @@ def findStringpoolAndResmap(chunks):
         raise Exception("No string pool found!")
     return (stringPoolIdx, resmapIdx)
 
-def decodeStringPoolInfo(f, chunkInfo):
-    offset = chunkInfo["startOffset"]
-    f.seek(offset + COMMON_HEADER_LEN)
-    (stringCount, styleCount, flags, stringsStart, stylesStart) = readInt(f, 5)
+def decodeStringPoolInfo(buf, chunkInfo):
+    offset = chunkInfo.startOffset
+    (stringCount, styleCount, flags, stringsStart, stylesStart) = _STRPOOL.unpack_from(buf, offset + COMMON_HEADER_LEN)
     return {
         "chunkInfo": chunkInfo,
         "stringCount" : stringCount,
@@ -130,10 +118,9 @@ def decodeStringPoolInfo(f, chunkInfo):
 
 # inserts "debuggable" string at insertionIdx
 # requires that insertionIdx < stringCount
-# todo: update styles (first is str ref)
-def patchStringPool(f, strPoolInfo, fOut, insertionIdx):
-    startOffset = strPoolInfo["chunkInfo"]["startOffset"]
-    f.seek(startOffset + COMMON_HEADER_LEN) # we write a new common header
+def patchStringPool(buf, strPoolInfo, out, outOffset, insertionIdx):
+    startOffset = strPoolInfo["chunkInfo"].startOffset
+    headerSize = strPoolInfo["chunkInfo"].headerSize
     isUtf8 = strPoolInfo["isUtf8"]
     debuggableStrLength = DEBUGGABLE_STRING_LENGTH_UTF8 if isUtf8 else DEBUGGABLE_STRING_LENGTH_UTF16
     newStrCount = strPoolInfo["stringCount"] + 1
@@ -141,139 +128,110 @@ def patchStringPool(f, strPoolInfo, fOut, insertionIdx):
     newStylesStart = 0
     if strPoolInfo["styleCount"] > 0:
         newStylesStart = strPoolInfo["stylesStart"] + UINT32_LENGTH + debuggableStrLength
-    newChunkSize = strPoolInfo["chunkInfo"]["commonHeader"]["chunkSize"] + debuggableStrLength + UINT32_LENGTH
-    writeCommonHeader(fOut, strPoolInfo["chunkInfo"]["commonHeader"]["type"], strPoolInfo["chunkInfo"]["commonHeader"]["headerSize"], newChunkSize)
-    fOut.write(pack("<5I", newStrCount, strPoolInfo["styleCount"], strPoolInfo["flags"], newStringsStart, newStylesStart))
-
-    # now we need to patch the string offset table
-    f.seek(startOffset + strPoolInfo["chunkInfo"]["commonHeader"]["headerSize"])
-    fOut.write(f.read((insertionIdx) * UINT32_LENGTH)) # copy up to insertionIdx, offsets havent changed up to here
-    insertionStringsOffset = readInt(f, 1) # we need this later
-    fOut.write(pack("<I", insertionStringsOffset))
-    fOut.write(pack("<I", insertionStringsOffset + debuggableStrLength))
-
-    # now, copy the remaining offsets but add debuggableStrLength to all of them
-    for i in range(insertionIdx + 1, strPoolInfo["stringCount"]):
-        fOut.write(pack("<I", readInt(f, 1) + debuggableStrLength))
-
-    if f.tell() != startOffset + strPoolInfo["chunkInfo"]["commonHeader"]["headerSize"] + UINT32_LENGTH * strPoolInfo["stringCount"]:
-        raise Exception("sanity check {} {}".format(f.tell(), startOffset + strPoolInfo["chunkInfo"]["commonHeader"]["headerSize"] + UINT32_LENGTH * strPoolInfo["stringCount"]))
-
-    # write style index table if there is any
-    if strPoolInfo["styleCount"] > 0:
-        fOut.write(f.read(strPoolInfo["styleCount"] * UINT32_LENGTH))
-
-    # in case there is some padding, copy that too
-    fOut.write(f.read(startOffset + strPoolInfo["stringsStart"] - f.tell()))
-
-    # copy the first strings up to the point where 'debuggable' gets inserted
-    fOut.write(f.read(insertionStringsOffset))
+    newChunkSize = strPoolInfo["chunkInfo"].chunkSize + debuggableStrLength + UINT32_LENGTH
+    writeCommonHeader(out, outOffset, strPoolInfo["chunkInfo"].type, headerSize, newChunkSize)
+    _STRPOOL.pack_into(out, outOffset + COMMON_HEADER_LEN, newStrCount, strPoolInfo["styleCount"], strPoolInfo["flags"], newStringsStart, newStylesStart)
+    offset = startOffset + COMMON_HEADER_LEN + _STRPOOL.size
+    outOffset = copyInto(out, outOffset + COMMON_HEADER_LEN + _STRPOOL.size, buf, offset, startOffset + headerSize) # in case the header is larger
+
+    # build the new string offset table in one go: the offsets before insertionIdx stay, 'debuggable' takes over
+    # the offset of the string at insertionIdx and all strings from there on move back by debuggableStrLength
+    offset = startOffset + headerSize
+    oldOffsets = Struct("<{}I".format(strPoolInfo["stringCount"])).unpack_from(buf, offset)
+    insertionStringsOffset = oldOffsets[insertionIdx]
+    newOffsets = Struct("<{}I".format(newStrCount))
+    newOffsets.pack_into(out, outOffset, *oldOffsets[:insertionIdx], insertionStringsOffset, *[o + debuggableStrLength for o in oldOffsets[insertionIdx:]])
+    offset += strPoolInfo["stringCount"] * UINT32_LENGTH
+    outOffset += newOffsets.size
+
+    # the style index table (relative to stylesStart, so it stays valid), any padding and the strings
+    # up to the point where 'debuggable' gets inserted are contiguous and copied as is
+    styleOffsets = Struct("<{}I".format(strPoolInfo["styleCount"])).unpack_from(buf, offset)
+    end = startOffset + strPoolInfo["stringsStart"] + insertionStringsOffset
+    outOffset = copyInto(out, outOffset, buf, offset, end)
+    offset = end
 
     # insert new string
-    fOut.write(DEBUGGABLE_STRING_DATA_UTF8 if isUtf8 else DEBUGGABLE_STRING_DATA_UTF16)
-
-    if strPoolInfo["styleCount"] > 0:
-        # copy up to styleStart
-        fOut.write(f.read(startOffset + strPoolInfo["stylesStart"] - f.tell()))
-        # copy styles
-        for i in range(strPoolInfo["styleCount"]):
-            (name, firstChar, lastChar) = unpack(readInt(f, 3))
-            if name != 0xFFFFFFFF and name >= insertionIdx:
-                name += 1
-            fOut.write(pack("<3I", name, firstChar, lastChar))
-
-    fOut.write(f.read(startOffset + strPoolInfo["chunkInfo"]["commonHeader"]["chunkSize"] - f.tell()))
-
-def calculateResMapLength(chunkInfo):
-    return (chunkInfo["commonHeader"]["chunkSize"] - chunkInfo["commonHeader"]["headerSize"]) // UINT32_LENGTH
-
-def findDebuggablResIndices(f, resmapInfo):
-    if resmapInfo["chunkInfo"] == None:
-        return [] # chunk is empty
-
-    startPos = resmapInfo["chunkInfo"]["startOffset"]
-    f.seek(startPos + resmapInfo["chunkInfo"]["headerSize"])
-    indices = []
-
-    for i in range(resmapInfo["len"]):
-        resId = readInt(f, 1)
-        if resId == DEBUGGABLE_RES_ID:
-            indices.append[i]
-
-    return indices
-
-# following three methods are mostly copied from androguard
+    debuggableStrData = DEBUGGABLE_STRING_DATA_UTF8 if isUtf8 else DEBUGGABLE_STRING_DATA_UTF16
+    out[outOffset:outOffset + debuggableStrLength] = debuggableStrData
+    outOffset += debuggableStrLength
 
-def decode8(fs):
-    # UTF-8 Strings contain two lengths, as they might differ:
-    # 1) the UTF-16 length
-    (str_len, bytesRead) = decodeLength(fs, 1) # todo assert equals length
+    # copy the rest of the strings and the styles
+    stylesOutOffset = outOffset + startOffset + strPoolInfo["stylesStart"] - offset
+    end = startOffset + strPoolInfo["chunkInfo"].chunkSize
+    outOffset = copyInto(out, outOffset, buf, offset, end)
 
-    # 2) the utf-8 string length
-    (strBytes, bytesRead2) = decodeLength(fs, 1)
+    # each style is a list of spans terminated by 0xFFFFFFFF, the span names are string refs
+    for styleOffset in styleOffsets:
+        spanOffset = stylesOutOffset + styleOffset
+        while spanOffset < outOffset and _U32.unpack_from(out, spanOffset)[0] != 0xFFFFFFFF:
+            patchStringRef(out, spanOffset, insertionIdx)
+            spanOffset += _SPAN.size
 
-    str = fs.read(strBytes).decode("utf-8", "replace")
-    if fs.read(1) != b"\x00":
-        raise Exception("String '{}' not terminated by NULL".format(str))
+    return outOffset
 
-    return (str, bytesRead + bytesRead2 + strBytes + 1)
-
-def decode16(fs):
-    (str_len, bytesRead) = decodeLength(fs, 2)
-
-    # The len is the string len in utf-16 units
-    strBytes = str_len * 2
-
-    str = fs.read(strBytes).decode("utf-16", "replace")
-    if fs.read(2) != b"\x00\x00":
-        raise Exception("String '{}' not terminated by NULL".format(str))
-    return (str,  bytesRead + strBytes + 2)
-
-def decodeLength(fs, sizeof_char):
-        fmt = "<2{}".format('B' if sizeof_char == 1 else 'H')
-        highbit = 0x80 << (8 * (sizeof_char - 1))
-
-        length1, length2 = unpack(fmt, fs.read(sizeof_char * 2))
-
-        if (length1 & highbit) != 0:
-            length = ((length1 & ~highbit) << (8 * sizeof_char)) | length2
-            bytesRead = sizeof_char * 2
-        else:
-            length = length1
-            fs.seek(-sizeof_char, SEEK_CUR) # go back a char
-            bytesRead = sizeof_char
-
-        # These are true asserts, as the size should never be less than the values
-        if sizeof_char == 1:
-            assert length <= 0x7FFF, "length of UTF-8 string is too large!"
-        else:
-            assert length <= 0x7FFFFFFF, "length of UTF-16 string is too large!"
+def calculateResMapLength(chunkInfo):
+    return (chunkInfo.chunkSize - chunkInfo.headerSize) // UINT32_LENGTH
+
+# reads all res ids at once, they are looked up for every application attribute
+def readResmap(buf, chunkInfo):
+    offset = chunkInfo.startOffset + chunkInfo.headerSize
+    return Struct("<{}I".format(calculateResMapLength(chunkInfo))).unpack_from(buf, offset)
+
+def findDebuggablResIndices(resmapInfo):
+    return [i for i, resId in enumerate(resmapInfo["resIds"]) if resId == DEBUGGABLE_RES_ID]
+
+# decodes the whole string pool once, all lookups are done in the returned list
+# the string format handling is mostly copied from androguard, inlined as it runs for every string
+def decodeAllStrings(buf, strPoolInfo):
+    stringOffsetsTableOffset = strPoolInfo["chunkInfo"].startOffset + strPoolInfo["chunkInfo"].headerSize
+    stringOffsets = Struct("<{}I".format(strPoolInfo["stringCount"])).unpack_from(buf, stringOffsetsTableOffset)
+    stringsOffset = strPoolInfo["chunkInfo"].startOffset + strPoolInfo["stringsStart"]
+    strings = [None] * len(stringOffsets)
+    if strPoolInfo["isUtf8"]:
+        for i, stringOffset in enumerate(stringOffsets):
+            offset = stringsOffset + stringOffset
+            # UTF-8 Strings contain two lengths, as they might differ:
+            # 1) the UTF-16 length, which we don't need
+            # 2) the utf-8 string length
+            # each takes two bytes instead of one if the high bit is set
+            offset += 2 if buf[offset] & 0x80 else 1
+            strBytes = buf[offset]
+            if strBytes & 0x80:
+                strBytes = ((strBytes & 0x7F) << 8) | buf[offset + 1]
+                offset += 2
+            else:
+                offset += 1
+            strings[i] = str(buf[offset:offset + strBytes], "utf-8", "replace")
+            if buf[offset + strBytes] != 0:
+                raise Exception("String '{}' not terminated by NULL".format(strings[i]))
+    else:
+        for i, stringOffset in enumerate(stringOffsets):
+            offset = stringsOffset + stringOffset
+            # The len is the string len in utf-16 units, two units if the high bit is set
+            strLen = _U16.unpack_from(buf, offset)[0]
+            if strLen & 0x8000:
+                strLen = ((strLen & 0x7FFF) << 16) | _U16.unpack_from(buf, offset + UINT16_LENGTH)[0]
+                offset += 2 * UINT16_LENGTH
+            else:
+                offset += UINT16_LENGTH
+            end = offset + strLen * 2
+            strings[i] = str(buf[offset:end], "utf-16", "replace")
+            if buf[end:end + 2] != b"\x00\x00":
+                raise Exception("String '{}' not terminated by NULL".format(strings[i]))
+    return strings
 
-        return (length, bytesRead)
+def readString(strings, idx):
+    return strings[idx] if 0 <= idx < len(strings) else None
 
-def readString(f, strPoolInfo, idx):
-    pos = f.tell() # todo: find more elegant solution that requires less seeking, maybe copy whole file in mem?
-    if not isInt32NotNegative(idx) or idx >= strPoolInfo["stringCount"]:
-        return None
-    # overall file offset to the location where the offset within the strings blob is stored
-    stringOffsetsTableOffset = strPoolInfo["chunkInfo"]["startOffset"] + strPoolInfo["chunkInfo"]["commonHeader"]["headerSize"]
-    f.seek(stringOffsetsTableOffset + idx*UINT32_LENGTH)
-    stringOffset = readInt(f, 1)
-    stringAbsoluteOffset = strPoolInfo["chunkInfo"]["startOffset"] + strPoolInfo["stringsStart"] + stringOffset
-    f.seek(stringAbsoluteOffset)
-    strVal = decode8(f)[0] if strPoolInfo["isUtf8"] else decode16(f)[0]
-    f.seek(pos)
-    return strVal
-
-def findApplication(f, chunks, strPoolInfo):
+def findApplication(buf, chunks, strings):
     applicationIdx = -1
     for i, chunkInfo in enumerate(chunks):
-        chunkType = chunkInfo["commonHeader"]["type"]
+        chunkType = chunkInfo.type
         if chunkType != CHUNK_TYPE_START_ELEMENT:
             continue
-        f.seek(chunkInfo["startOffset"] + chunkInfo["commonHeader"]["headerSize"] + 4) # +4 to skip NS
-        nameId = readInt(f, 1)
-        name = readString(f, strPoolInfo, nameId)
+        nameId = _U32.unpack_from(buf, chunkInfo.startOffset + chunkInfo.headerSize + 4)[0] # +4 to skip NS
+        name = readString(strings, nameId)
         if name != APPLICATION_STRING:
             continue
         if applicationIdx >= 0:
@@ -283,163 +241,150 @@ def findApplication(f, chunks, strPoolInfo):
         raise Exception("No application element found!")
     return applicationIdx
 
-def decodeAttributes(f, applicationChunk):
-    chunkDataStart = applicationChunk["startOffset"] + applicationChunk["commonHeader"]["headerSize"]
-    f.seek(chunkDataStart + 8) # +8 to skip ns and name
-    (attributeStart, attributeSize, attributeCount, idIndex, classIndex, styleIndex) = readShort(f, 6)
+def decodeAttributes(buf, applicationChunk):
+    chunkDataStart = applicationChunk.startOffset + applicationChunk.headerSize
+    (attributeStart, attributeSize, attributeCount) = _ATTR_INFO.unpack_from(buf, chunkDataStart + 8) # +8 to skip ns and name
     if attributeSize != ATTRIBUTE_LENGTH:
         raise Exception("Cannot decode attribute length != {}!".format(ATTRIBUTE_LENGTH))
-    f.seek(chunkDataStart + attributeStart)
     attrs = []
-    for _ in range(attributeCount):
-        attrOffset = f.tell()
-        (ns, name, rawVal, size, _, dataType, data) = unpack("<IIIHBBI", f.read(ATTRIBUTE_LENGTH))
-        attrs.append({
-            "startOffset": attrOffset,
-            "nsId": ns,
-            "nameId": name,
-            "rawVal": rawVal,
-            "size": size,
-            "dataType": dataType,
-            "data": data
-        })
+    for i in range(attributeCount):
+        attrOffset = chunkDataStart + attributeStart + i * ATTRIBUTE_LENGTH
+        (ns, name, rawVal, size, _, dataType, data) = _ATTR.unpack_from(buf, attrOffset)
+        attrs.append(Attr(attrOffset, ns, name, rawVal, size, dataType, data))
     return attrs
 
-def readResId(f, resmapInfo, idx):
+def readResId(resmapInfo, idx):
     if idx >= resmapInfo["len"]:
         return None
-    pos = f.tell()
-    f.seek(resmapInfo["chunkInfo"]["startOffset"] + resmapInfo["chunkInfo"]["commonHeader"]["headerSize"] + idx * UINT32_LENGTH)
-    resId = readInt(f, 1)
-    f.seek(pos)
-    return resId
-
-def patchResmap(f, resmapInfo, fOut):
-    f.seek(resmapInfo["chunkInfo"]["startOffset"] + COMMON_HEADER_LEN)
-    newChunkSize = resmapInfo["chunkInfo"]["commonHeader"]["chunkSize"] + UINT32_LENGTH # new res id
-    writeCommonHeader(fOut, resmapInfo["chunkInfo"]["commonHeader"]["type"], resmapInfo["chunkInfo"]["commonHeader"]["headerSize"], newChunkSize)
-    toCopy = resmapInfo["chunkInfo"]["commonHeader"]["chunkSize"] - COMMON_HEADER_LEN # common header already written
-    fOut.write(f.read(toCopy))
-    fOut.write(pack("<I", DEBUGGABLE_RES_ID))
-
-def injectResmap(fOut):
-    writeCommonHeader(fOut, CHUNK_TYPE_RESMAP, COMMON_HEADER_LEN, COMMON_HEADER_LEN + UINT32_LENGTH)
-    fOut.write(pack("<I", DEBUGGABLE_RES_ID))
-
-def findDebuggableAttribute(f, strPoolInfo, resmapInfo, attrs):
+    return resmapInfo["resIds"][idx]
+
+def patchResmap(buf, resmapInfo, out, outOffset):
+    startOffset = resmapInfo["chunkInfo"].startOffset
+    newChunkSize = resmapInfo["chunkInfo"].chunkSize + UINT32_LENGTH # new res id
+    writeCommonHeader(out, outOffset, resmapInfo["chunkInfo"].type, resmapInfo["chunkInfo"].headerSize, newChunkSize)
+    outOffset = copyInto(out, outOffset + COMMON_HEADER_LEN, buf, startOffset + COMMON_HEADER_LEN, startOffset + resmapInfo["chunkInfo"].chunkSize) # common header already written
+    _U32.pack_into(out, outOffset, DEBUGGABLE_RES_ID)
+    return outOffset + UINT32_LENGTH
+
+def injectResmap(out, outOffset):
+    writeCommonHeader(out, outOffset, CHUNK_TYPE_RESMAP, COMMON_HEADER_LEN, COMMON_HEADER_LEN + UINT32_LENGTH)
+    _U32.pack_into(out, outOffset + COMMON_HEADER_LEN, DEBUGGABLE_RES_ID)
+    return outOffset + COMMON_HEADER_LEN + UINT32_LENGTH
+
+def findDebuggableAttribute(stringIds, resmapInfo, attrs):
+    debuggableNameId = stringIds.get(DEBUGGABLE_STRING, -1)
     for i, attr in enumerate(attrs):
-        nameId = attr["nameId"]
-        name = readString(f, strPoolInfo, nameId)
-        resId = readResId(f, resmapInfo, nameId)
-        if name == DEBUGGABLE_STRING and resId == DEBUGGABLE_RES_ID:
+        if attr.nameId == debuggableNameId and readResId(resmapInfo, debuggableNameId) == DEBUGGABLE_RES_ID:
             return i
     return -1
 
-def patchStringRef(fIn, fOut, cmp):
-    n = readInt(fIn, 1)
+# the patch* helpers below work in place on chunks that have already been copied to out
+
+def shiftStringRef(n, cmp):
+    return n + 1 if n != 0xFFFFFFFF and n >= cmp else n
+
+def patchStringRef(out, offset, cmp):
+    n = _U32.unpack_from(out, offset)[0]
     if n != 0xFFFFFFFF and n >= cmp:
-        n += 1
-    fOut.write(pack("<I", n))
-
-def patchNode(fIn, fOut, debuggableStringId):
-    fOut.write(fIn.read(UINT32_LENGTH)) # lineNo
-    patchStringRef(fIn, fOut, debuggableStringId) # comment
-
-def patchCDataExt(fIn, fOut, debuggableStringId):
-    patchStringRef(fIn, fOut, debuggableStringId) # data
-    fOut.write(fIn.read(2*UINT32_LENGTH)) # typedData
-
-def patchNamespaceExt(fIn, fOut, debuggableStringId):
-    patchStringRef(fIn, fOut, debuggableStringId) # prefix
-    patchStringRef(fIn, fOut, debuggableStringId) # uri
-
-def patchEndElementExt(fIn, fOut, debuggableStringId):
-    patchStringRef(fIn, fOut, debuggableStringId) # ns
-    patchStringRef(fIn, fOut, debuggableStringId) # name
-
-def patchAttrExt(fIn, fOut, chunkInfo, debuggableStringId):
-    startOffset = chunkInfo["startOffset"]
-    end = startOffset + chunkInfo["commonHeader"]["chunkSize"]
-    patchStringRef(fIn, fOut, debuggableStringId) # ns
-    patchStringRef(fIn, fOut, debuggableStringId) # name
-    (attrStart, attrSize, currAttrCount) = readShort(fIn, 3)
-    fOut.write(pack("<HHH", attrStart, attrSize, currAttrCount))
-    fOut.write(fIn.read(UINT16_LENGTH * 3)) # rest
-    fOut.write(fIn.read(startOffset + chunkInfo["commonHeader"]["headerSize"] + attrStart - fIn.tell())) # in case there is anything here
-    for _ in range(currAttrCount):
-        patchAttribute(fIn, fOut, debuggableStringId)
-    fOut.write(fIn.read(end - fIn.tell())) # incase there is anything here
-
-def patchAttribute(fIn, fOut, debuggableStringId):
-    patchStringRef(fIn, fOut, debuggableStringId) # ns
-    patchStringRef(fIn, fOut, debuggableStringId) # name
-    patchStringRef(fIn, fOut, debuggableStringId) # rawValue
-    (size, res0, type) = unpack("<HBB", fIn.read(4))
-    fOut.write(pack("<HBB", size, res0, type))
-    if type == 0x03: # string
-        patchStringRef(fIn, fOut, debuggableStringId)
-    else:
-        fOut.write(fIn.read(UINT32_LENGTH)) # data
-
-def patchChunk(f, chunkInfo, fOut, debuggableStringId):
-    f.seek(chunkInfo["startOffset"])
-    fOut.write(f.read(COMMON_HEADER_LEN)) # copy header
-    type = chunkInfo["commonHeader"]["type"]
-    if type >= 0x0100 and type <= 0x17f:
-        patchNode(f, fOut, debuggableStringId)
-        if type == 0x100 or type == 0x101: # start/end NS
-            patchNamespaceExt(f, fOut, debuggableStringId)
-        elif type == 0x102: # start
-            patchAttrExt(f, fOut, chunkInfo, debuggableStringId)
-        elif type == 0x103: # end element
-            patchEndElementExt(f, fOut, debuggableStringId)
-        elif type == 0x104: # cdata
-            patchCDataExt(f, fOut, debuggableStringId)
-        else:
-            fOut.write(f.read(chunkInfo["commonHeader"]["chunkSize"] - chunkInfo["commonHeader"]["headerSize"]))
-    else:
-        fOut.write(f.read(chunkInfo["commonHeader"]["chunkSize"] - COMMON_HEADER_LEN)) # already copied common header
+        _U32.pack_into(out, offset, n + 1)
+
+def patchStringRefs2(out, offset, cmp):
+    (a, b) = _REF2.unpack_from(out, offset)
+    _REF2.pack_into(out, offset, shiftStringRef(a, cmp), shiftStringRef(b, cmp))
+
+def patchNode(out, offset, debuggableStringId):
+    patchStringRef(out, offset + UINT32_LENGTH, debuggableStringId) # comment, lineNo is unchanged
+
+def patchCDataExt(out, offset, debuggableStringId):
+    patchStringRef(out, offset, debuggableStringId) # data, typedData is unchanged
+
+def patchNamespaceExt(out, offset, debuggableStringId):
+    patchStringRefs2(out, offset, debuggableStringId) # prefix, uri
+
+def patchEndElementExt(out, offset, debuggableStringId):
+    patchStringRefs2(out, offset, debuggableStringId) # ns, name
+
+def patchAttrExt(out, offset, debuggableStringId):
+    (ns, name, attrStart, attrSize, currAttrCount) = _ATTR_EXT.unpack_from(out, offset)
+    _REF2.pack_into(out, offset, shiftStringRef(ns, debuggableStringId), shiftStringRef(name, debuggableStringId))
+    for i in range(currAttrCount):
+        patchAttribute(out, offset + attrStart + i * attrSize, debuggableStringId)
+
+# the whole attribute is read and written in one go, this runs for every attribute in the file
+def patchAttribute(out, offset, debuggableStringId):
+    (ns, name, rawVal, size, res0, dataType, data) = _ATTR.unpack_from(out, offset)
+    if dataType == 0x03: # string
+        data = shiftStringRef(data, debuggableStringId)
+    _ATTR.pack_into(out, offset, shiftStringRef(ns, debuggableStringId), shiftStringRef(name, debuggableStringId),
+                    shiftStringRef(rawVal, debuggableStringId), size, res0, dataType, data)
+
+def patchChunk(out, outOffset, chunkInfo, debuggableStringId):
+    type = chunkInfo.type
+    if type < 0x0100 or type > 0x17f:
+        return # not an xml node, nothing refers to the string pool
+    patchNode(out, outOffset + COMMON_HEADER_LEN, debuggableStringId)
+    extOffset = outOffset + chunkInfo.headerSize
+    if type == 0x100 or type == 0x101: # start/end NS
+        patchNamespaceExt(out, extOffset, debuggableStringId)
+    elif type == 0x102: # start
+        patchAttrExt(out, extOffset, debuggableStringId)
+    elif type == 0x103: # end element
+        patchEndElementExt(out, extOffset, debuggableStringId)
+    elif type == 0x104: # cdata
+        patchCDataExt(out, extOffset, debuggableStringId)
+
+# copies a run of consecutive chunks at once and patches their string refs in place
+def patchChunks(buf, chunks, out, outOffset, debuggableStringId):
+    runStart = chunks[0].startOffset
+    runEnd = chunks[-1].startOffset + chunks[-1].chunkSize
+    copyInto(out, outOffset, buf, runStart, runEnd)
+    for chunkInfo in chunks:
+        patchChunk(out, outOffset + chunkInfo.startOffset - runStart, chunkInfo, debuggableStringId)
+    return outOffset + runEnd - runStart
 
 # attrs are sorted by ref id!
-def patchApplicationAttributes(fIn, fOut, attrCount, resmapInfo, debuggableStringId, androidNsId):
-    inserted = False
-    for i in range(attrCount):
-        # first get name
-        fIn.seek(UINT32_LENGTH, SEEK_CUR) # skip ns
-        name = readInt(fIn, 1) # read nameId
-        if readResId(fIn, resmapInfo, name) > DEBUGGABLE_RES_ID and not inserted:
-            # first with resId >, insert here:
-            fOut.write(pack("<5L", androidNsId, debuggableStringId, 0xFFFFFFFF, 0x12000008, 0xFFFFFFFF))
-            inserted = True
-        fIn.seek(-2 * UINT32_LENGTH, SEEK_CUR) # roll back to start of attribute
-        patchAttribute(fIn, fOut, debuggableStringId)
-    if not inserted: # all attribute res ids were < debuggable res id
-        fOut.write(pack("<5L", androidNsId, debuggableStringId, 0xFFFFFFFF, 0x12000008, 0xFFFFFFFF))
-
-def patchApplicationElement(fIn, chunkInfo, androidNsId, debuggableStringId, fOut, resmapInfo):
-    startOffset = chunkInfo["startOffset"]
-    headerSize = chunkInfo["commonHeader"]["headerSize"]
-    fIn.seek(startOffset + COMMON_HEADER_LEN) # we create a new common header
-    newChunkSize = chunkInfo["commonHeader"]["chunkSize"] + ATTRIBUTE_LENGTH # new attribute length
-    writeCommonHeader(fOut, chunkInfo["commonHeader"]["type"], headerSize, newChunkSize)
-    patchNode(fIn, fOut, debuggableStringId) # lineNo and comment
-    patchStringRef(fIn, fOut, debuggableStringId) # ns
-    patchStringRef(fIn, fOut, debuggableStringId) # name
-    (attrStart, attrSize, currAttrCount) = readShort(fIn, 3)
-    fOut.write(pack("<HHH", attrStart, attrSize, currAttrCount + 1))
-    fOut.write(fIn.read(UINT16_LENGTH * 3)) # copy id, class and style
-    fOut.write(fIn.read(startOffset + headerSize + attrStart - fIn.tell())) # in case there is anything here
+# copies the attributes in two runs around the new debuggable attribute and patches them in place
+def patchApplicationAttributes(buf, offset, out, outOffset, attrs, resmapInfo, debuggableStringId, androidNsId):
+    # insert before the first attribute with a larger res id, attributes without res id come last
+    insertionIdx = len(attrs)
+    for i, attr in enumerate(attrs):
+        resId = readResId(resmapInfo, attr.nameId)
+        if resId is None or resId > DEBUGGABLE_RES_ID:
+            insertionIdx = i
+            break
+    insertionOffset = offset + insertionIdx * ATTRIBUTE_LENGTH
+    outInsertionOffset = copyInto(out, outOffset, buf, offset, insertionOffset)
+    _ATTR.pack_into(out, outInsertionOffset, androidNsId, debuggableStringId, 0xFFFFFFFF, 8, 0, 0x12, 0xFFFFFFFF)
+    copyInto(out, outInsertionOffset + ATTRIBUTE_LENGTH, buf, insertionOffset, offset + len(attrs) * ATTRIBUTE_LENGTH)
+    for i in range(len(attrs) + 1):
+        if i != insertionIdx:
+            patchAttribute(out, outOffset + i * ATTRIBUTE_LENGTH, debuggableStringId)
+
+def patchApplicationElement(buf, chunkInfo, attrs, androidNsId, debuggableStringId, out, outOffset, resmapInfo):
+    startOffset = chunkInfo.startOffset
+    headerSize = chunkInfo.headerSize
+    extOffset = outOffset + headerSize
+    (attrStart, attrSize, currAttrCount) = _ATTR_INFO.unpack_from(buf, startOffset + headerSize + 2 * UINT32_LENGTH)
+    attrOffset = startOffset + headerSize + attrStart
+    copyInto(out, outOffset, buf, startOffset, attrOffset) # header and everything up to the attributes
+    newChunkSize = chunkInfo.chunkSize + ATTRIBUTE_LENGTH # new attribute length
+    writeCommonHeader(out, outOffset, chunkInfo.type, headerSize, newChunkSize)
+    patchNode(out, outOffset + COMMON_HEADER_LEN, debuggableStringId) # comment
+    patchStringRef(out, extOffset, debuggableStringId) # ns
+    patchStringRef(out, extOffset + UINT32_LENGTH, debuggableStringId) # name
+    _ATTR_INFO.pack_into(out, extOffset + 2 * UINT32_LENGTH, attrStart, attrSize, currAttrCount + 1)
     # now patch attributes
-    patchApplicationAttributes(fIn, fOut, currAttrCount, resmapInfo, debuggableStringId, androidNsId)
-    fOut.write(fIn.read(startOffset + chunkInfo["commonHeader"]["chunkSize"] - fIn.tell())) # incase there is anything here
-
-def findAndroidNsIdx(fIn, strPoolInfo):
-    pos = fIn.tell()
-    for i in range(strPoolInfo["stringCount"]):
-        if readString(fIn, strPoolInfo, i) == ANDROID_NS_STRING:
-            fIn.seek(pos)
-            return i
-    raise Exception("No android ns found ...")
+    outAttrOffset = extOffset + attrStart
+    patchApplicationAttributes(buf, attrOffset, out, outAttrOffset, attrs, resmapInfo, debuggableStringId, androidNsId)
+    offset = attrOffset + currAttrCount * ATTRIBUTE_LENGTH
+    outOffset = outAttrOffset + (currAttrCount + 1) * ATTRIBUTE_LENGTH
+    return copyInto(out, outOffset, buf, offset, startOffset + chunkInfo.chunkSize) # incase there is anything here
+
+def findAndroidNsIdx(stringIds):
+    try:
+        return stringIds[ANDROID_NS_STRING]
+    except KeyError:
+        raise Exception("No android ns found ...")
 
 # in order for the application to be counted as debuggable the application
 # tag needs to contain an attribute whose resource id is debuggable res id
@@ -461,36 +406,40 @@ def findAndroidNsIdx(fIn, strPoolInfo):
 #   add N to filesize header
 #   update string pool , res map and all attribute name values ...
 def patchManifest(fIn, fOut):
-    fileHeader = readCommonHeader(fIn)
-    if fileHeader["headerSize"] != COMMON_HEADER_LEN:
+    # the manifest is small, so parse it from memory instead of seeking around in fIn
+    buf = memoryview(fIn.read())
+    fileHeader = readCommonHeader(buf, 0)
+    if fileHeader.headerSize != COMMON_HEADER_LEN:
         raise Exception("File header not of size 8!")
-    chunks = readChunks(fIn)
+    chunks = readChunks(buf, COMMON_HEADER_LEN)
     (stringPoolIdx, resmapIdx) = findStringpoolAndResmap(chunks)
-    strPoolInfo = decodeStringPoolInfo(fIn, chunks[stringPoolIdx])
+    strPoolInfo = decodeStringPoolInfo(buf, chunks[stringPoolIdx])
+    strings = decodeAllStrings(buf, strPoolInfo)
+    stringIds = {s: i for i, s in reversed(list(enumerate(strings)))} # first index wins if the pool has duplicates
     if resmapIdx == -1:
         resmapInfo = {
             "chunkInfo": None,
             "len": 0,
+            "resIds": ()
         }
     if resmapIdx >= 0:
-        resMapLen = calculateResMapLength(chunks[resmapIdx])
+        resIds = readResmap(buf, chunks[resmapIdx])
         resmapInfo = {
             "chunkInfo": chunks[resmapIdx],
-            "len": resMapLen
+            "len": len(resIds),
+            "resIds": resIds
         }
-    applicationIdx = findApplication(fIn, chunks, strPoolInfo)
-    print("Found application tag at {} !".format(chunks[applicationIdx]["startOffset"]))
-    applicationAttributes = decodeAttributes(fIn, chunks[applicationIdx])
-    debuggableAttributeIdx = findDebuggableAttribute(fIn, strPoolInfo, resmapInfo, applicationAttributes)
+    applicationIdx = findApplication(buf, chunks, strings)
+    print("Found application tag at {} !".format(chunks[applicationIdx].startOffset))
+    applicationAttributes = decodeAttributes(buf, chunks[applicationIdx])
+    debuggableAttributeIdx = findDebuggableAttribute(stringIds, resmapInfo, applicationAttributes)
     if debuggableAttributeIdx >= 0:
         print("Found debuggable attribute!")
-        debuggableValueAbsoluteOffset = applicationAttributes[debuggableAttributeIdx]["startOffset"] + 16 # offset of data word
+        debuggableValueAbsoluteOffset = applicationAttributes[debuggableAttributeIdx].startOffset + 16 # offset of data word
         print("Copying file ...")
-        fIn.seek(0)
-        fOut.write(fIn.read(debuggableValueAbsoluteOffset))
-        fOut.write(DEBUGGABLE_VALUE_TRUE)
-        fIn.seek(4, SEEK_CUR)
-        fOut.write(fIn.read())
+        out = bytearray(buf)
+        out[debuggableValueAbsoluteOffset:debuggableValueAbsoluteOffset + UINT32_LENGTH] = DEBUGGABLE_VALUE_TRUE
+        fOut.write(out)
         return
     else:
         print("Debuggable not present, need to update string pool, res map and attributes ...")
@@ -501,63 +450,118 @@ def patchManifest(fIn, fOut):
         if resmapIdx == -1:
             totalSizeIncrement += COMMON_HEADER_LEN # new resmap chunk requires +8 for header
         totalSizeIncrement += ATTRIBUTE_LENGTH # new attribute
-        writeCommonHeader(fOut, fileHeader["type"], fileHeader["headerSize"], fileHeader["chunkSize"] + totalSizeIncrement)
+        # the new size is known up front, so the whole file is assembled in a single buffer
+        out = bytearray(fileHeader.chunkSize + totalSizeIncrement)
+        writeCommonHeader(out, 0, fileHeader.type, fileHeader.headerSize, len(out))
+        outOffset = COMMON_HEADER_LEN
         # get android ns string id
-        androidNsId = findAndroidNsIdx(fIn, strPoolInfo)
+        androidNsId = findAndroidNsIdx(stringIds)
         debuggableStringId = resmapInfo["len"] # every ref >= must be incremented ...
         if androidNsId >= debuggableStringId:
             androidNsId += 1
         print("Injecting 'debuggable' at index {} ...".format(debuggableStringId))
+        rebuiltIndices = (stringPoolIdx, resmapIdx, applicationIdx)
         i = 0
         chunkLen = len(chunks)
         while i < chunkLen:
             chunkInfo = chunks[i]
-            if i == stringPoolIdx + 1 and resmapIdx < 0: # inject new resmap
-                injectResmap(fOut)
-                i -= 1 # dont inrease i
-            elif i == stringPoolIdx:
-                patchStringPool(fIn, strPoolInfo, fOut, debuggableStringId)
+            if i == stringPoolIdx:
+                outOffset = patchStringPool(buf, strPoolInfo, out, outOffset, debuggableStringId)
+                if resmapIdx < 0: # inject new resmap
+                    outOffset = injectResmap(out, outOffset)
             elif i == resmapIdx:
-                patchResmap(fIn, resmapInfo, fOut)
+                outOffset = patchResmap(buf, resmapInfo, out, outOffset)
             elif i == applicationIdx:
-                patchApplicationElement(fIn, chunkInfo, androidNsId, debuggableStringId, fOut, resmapInfo)
+                outOffset = patchApplicationElement(buf, chunkInfo, applicationAttributes, androidNsId, debuggableStringId, out, outOffset, resmapInfo)
             else:
-                patchChunk(fIn, chunkInfo, fOut, debuggableStringId)
+                # everything up to the next chunk that has to be rebuilt is copied in one go
+                runEnd = i + 1
+                while runEnd < chunkLen and runEnd not in rebuiltIndices:
+                    runEnd += 1
+                outOffset = patchChunks(buf, chunks[i:runEnd], out, outOffset, debuggableStringId)
+                i = runEnd - 1
             i += 1
+        if outOffset != len(out):
+            raise Exception("sanity check {} {}".format(outOffset, len(out)))
+        fOut.write(out)
 
 def patchManifestByFilename(fnIn, fnOut):
-    with BytesIO() as tmp:
-        with open(fnIn, "rb") as fIn:
-            patchManifest(fIn, tmp)
-        tmp.seek(0)
-        with open(fnOut, "wb") as fOut:
-            fOut.write(tmp.read())
+    with open(fnIn, "rb") as fIn, open(fnOut, "wb") as fOut:
+        patchManifest(fIn, fOut)
 
 def extractToDir(zfn, dir):
     with ZipFile(zfn, "r") as zf:
         zf.extractall(dir)
 
-def patchApk(fnIn, fnOut, keystore, keyAlias, keystorePass):
+_ZIP_LOCAL_HEADER = Struct("<4s22xHH") # signature, ..., file name length, extra field length
+COPY_BLOCK_SIZE = 1 << 20
+
+# copies count bytes from the current position of src to the current position of dst
+# on linux the kernel does the copy (or clones the blocks on reflink capable filesystems), otherwise
+# and for whatever the kernel did not copy, the bytes are streamed in big blocks
+def copyFileRange(src, dst, count):
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            srcOffset = src.tell()
+            dst.flush() # the kernel writes to the file directly, so everything buffered has to be out first
+            dstOffset = dst.tell()
+            while copied < count:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), count - copied, srcOffset + copied, dstOffset + copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass # not supported for these files, copy the rest by hand
+        if copied > 0:
+            src.seek(srcOffset + copied)
+            dst.seek(dstOffset + copied)
+    remaining = count - copied
+    while remaining > 0:
+        block = src.read(min(remaining, COPY_BLOCK_SIZE))
+        if not block:
+            raise Exception("Unexpected end of file after {} of {} bytes!".format(count - remaining, count))
+        dst.write(block)
+        remaining -= len(block)
+
+# copies the compressed data of an entry as is, it doesn't change so there is no need to inflate and deflate it again
+# ZipFile has no public api for that, so the entry is appended to outZip by hand
+def copyRawEntry(inZip, info, outZip):
+    inZip.fp.seek(info.header_offset)
+    (signature, nameLength, extraLength) = _ZIP_LOCAL_HEADER.unpack(inZip.fp.read(_ZIP_LOCAL_HEADER.size))
+    if signature != b"PK\x03\x04":
+        raise Exception("Bad local file header for {}!".format(info.filename))
+    inZip.fp.seek(nameLength + extraLength, os.SEEK_CUR)
+    zinfo = copy(info)
+    zinfo.flag_bits &= ~0x08 # sizes are known, so no data descriptor
+    zinfo.header_offset = outZip.fp.tell()
+    outZip.fp.write(zinfo.FileHeader())
+    copyFileRange(inZip.fp, outZip.fp, info.compress_size)
+    outZip.start_dir = outZip.fp.tell()
+    outZip.filelist.append(zinfo)
+    outZip.NameToInfo[zinfo.filename] = zinfo
+    outZip._didModify = True
+
+def patchApk(fnIn, fnOut, keystore, keyAlias, keystorePass, verify=False):
     inZip = ZipFile(fnIn, "r")
-    outZip = ZipFile(fnOut + ".tmp", "w")
+    # the unaligned apk is only read back once by zipalign, so it goes to the temp dir (often a tmpfs) instead of
+    # next to fnOut, the directory is also removed on exit if one of the steps below fails
+    tmpDir = TemporaryDirectory(prefix="makeDebuggable")
+    outZip = ZipFile(os.path.join(tmpDir.name, os.path.basename(fnOut)), "w", ZIP_STORED)
 
     print("Patching AndroidManifest.xml ...")
     androidManifestPath = "AndroidManifest.xml"
-    with BytesIO() as tmp:
-        with inZip.open(androidManifestPath, "r") as fIn:
-            patchManifest(fIn, tmp)
-        tmp.seek(0)
-        with outZip.open(androidManifestPath, "w") as fOut:
-            fOut.write(tmp.read())
+    # the manifest is the only entry that gets written anew, storing it keeps deflate out of the rebuild entirely
+    manifestInfo = copy(inZip.getinfo(androidManifestPath))
+    manifestInfo.compress_type = ZIP_STORED
+    with inZip.open(androidManifestPath, "r") as fIn, outZip.open(manifestInfo, "w") as fOut:
+        patchManifest(fIn, fOut)
 
     print("Copying rest of files")
     for file in inZip.infolist():
         if file.filename in [androidManifestPath]:
             continue
-        with inZip.open(file, "r") as fIn:
-            with outZip.open(file, "w") as fOut:
-                while chunk := fIn.read(8192):
-                    fOut.write(chunk)
+        copyRawEntry(inZip, file, outZip)
 
     inZip.close()
     outZip.close()
@@ -569,14 +573,19 @@ def patchApk(fnIn, fnOut, keystore, keyAlias, keystorePass):
     print("Using zipalign at " + zipAlignLoc)
 
     print("Aligning...")
-    if subprocess.run([zipAlignLoc, "-p", "-v", "4", outZip.filename, fnOut]).returncode != 0:
+    alignResult = subprocess.run([zipAlignLoc, "-p", "-v", "4", outZip.filename, fnOut])
+    print("Removing temporary file...")
+    tmpDir.cleanup()
+    if alignResult.returncode != 0:
         print("zipalign failed, aborting.")
         sys.exit(1)
 
-    print("Verifying alignment...")
-    if subprocess.run([zipAlignLoc, "-c", "-v", "4", fnOut]).returncode != 0:
-        print("Alignment verification failed, aborting.")
-        sys.exit(1)
+    # both verification steps read the whole output apk once more, so they only run on request
+    if verify:
+        print("Verifying alignment...")
+        if subprocess.run([zipAlignLoc, "-c", "-v", "4", fnOut]).returncode != 0:
+            print("Alignment verification failed, aborting.")
+            sys.exit(1)
 
     apksignerLoc = which("apksigner")
     if not apksignerLoc:
@@ -589,16 +598,14 @@ def patchApk(fnIn, fnOut, keystore, keyAlias, keystorePass):
         print("apksigner failed, aborting.")
         sys.exit(1)
 
-    print("Verifying signature...")
-    if subprocess.run([apksignerLoc, "verify", fnOut]).returncode != 0:
-        print("Signature verification failed, aborting.")
-        sys.exit(1)
-
-    print("Removing temporary file...")
-    os.remove(outZip.filename)
+    if verify:
+        print("Verifying signature...")
+        if subprocess.run([apksignerLoc, "verify", fnOut]).returncode != 0:
+            print("Signature verification failed, aborting.")
+            sys.exit(1)
 
 def usage():
-    print(f"Usage: { sys.argv[0] } apk [fileIn] [fileOut] [keystore] [key alias] [keystore password]")
+    print(f"Usage: { sys.argv[0] } apk [--verify] [fileIn] [fileOut] [keystore] [key alias] [keystore password]")
     print("or")
     print(f"Usage: { sys.argv[0] } xml [fileIn] [fileOut]")
     sys.exit(1)
@@ -616,5 +623,7 @@ if __name__ == "__main__":
         patchManifestByFilename(sys.argv[2], sys.argv[3])
     elif option == "apk" and len(sys.argv) == 7:
         patchApk(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
+    elif option == "apk" and len(sys.argv) == 8 and sys.argv[2] == "--verify":
+        patchApk(sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6], sys.argv[7], True)
     else:
         usage()